@@ -3,15 +3,25 @@ Movie Insights - Streamlit Web UI
 動画シーン分析アプリケーション
 """
 
+import math
 import os
 import tempfile
 import shutil
 from pathlib import Path
+from typing import List, Tuple
 
 import streamlit as st
-
-from scene_detector import MovieInsights
-from exporters import export_to_excel, export_to_pptx, export_images_zip
+from PIL import Image
+
+from scene_detector import (
+    MovieInsights,
+    SceneInfo,
+    CancelToken,
+    OperationCancelled,
+    PREVIEWS_DIRNAME,
+    ProgressEvent,
+)
+from exporters import export_to_excel, export_to_pptx, StreamingImageZip
 
 
 # ページ設定
@@ -36,6 +46,140 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# ギャラリー設定
+GALLERY_COLS = 4
+GALLERY_PAGE_SIZE = 24
+PREVIEW_SIZE = (320, 180)
+
+
+def get_preview_path(scene: SceneInfo, size: Tuple[int, int] = PREVIEW_SIZE) -> str:
+    """
+    ギャラリー表示用の縮小プレビュー画像を取得する
+
+    プレビューはサムネイルと同じディレクトリの previews/ に一度だけ生成し、
+    以降の再実行ではディスク上のファイルをそのまま使う。
+    ファイル名はフレーム範囲から決めるため、差分抽出でシーン番号が
+    付け替わってもプレビューは作り直さない
+
+    Args:
+        scene: サムネイルパスが設定されたシーン情報
+        size: プレビューの最大サイズ (width, height)
+
+    Returns:
+        プレビュー画像のパス
+    """
+    source = Path(scene.thumbnail_path)
+    preview = source.parent / PREVIEWS_DIRNAME / f"{scene.start_frame}-{scene.end_frame}.jpg"
+
+    # 元画像より古いプレビューは作り直す
+    if not preview.exists() or preview.stat().st_mtime < source.stat().st_mtime:
+        preview.parent.mkdir(exist_ok=True)
+        with Image.open(source) as img:
+            img.thumbnail(size, Image.Resampling.LANCZOS)
+            img.save(preview, format="JPEG", quality=80)
+
+    return str(preview)
+
+
+def format_progress(event: ProgressEvent) -> str:
+    """進捗バーに表示するテキストを作成"""
+    label = "シーンを検出中" if event.stage == "detect" else "サムネイルを抽出中"
+    unit = "フレーム" if event.stage == "detect" else "シーン"
+    text = f"{label}... {event.processed:,} / {event.total:,} {unit} ({event.fps:.0f} fps)"
+    if event.eta is not None:
+        text += f" 残り {SceneInfo._seconds_to_timecode(event.eta)}"
+    return text
+
+
+def _cancel_analysis():
+    """実行中の分析をキャンセルする（ボタンのコールバック）"""
+    cancel_token = st.session_state.get("cancel_token")
+    if cancel_token:
+        cancel_token.cancel()
+
+
+def _show_downloads():
+    """ダウンロードボタンを表示する（ボタンのコールバック）"""
+    st.session_state["show_downloads"] = True
+
+
+def _hide_downloads():
+    """
+    ダウンロードボタンを隠す（ギャラリー操作のコールバック）
+
+    ダウンロードボタンは表示のたびに出力ファイル全体を読み込むため、
+    ページ送りの再実行では描画しない
+    """
+    st.session_state["show_downloads"] = False
+
+
+def _shift_gallery_page(offset: int, page_count: int):
+    """ギャラリーのページを前後に移動する（ボタンのコールバック）"""
+    _hide_downloads()
+    page = st.session_state.get("gallery_page", 0) + offset
+    st.session_state["gallery_page"] = min(max(page, 0), page_count - 1)
+
+
+def render_scene_gallery(scenes: List[SceneInfo]):
+    """
+    シーン一覧をページ単位で表示する
+
+    表示中のページのプレビューだけを描画するため、シーン数が増えても
+    ページの描画コストは一定に保たれる
+
+    Args:
+        scenes: シーン情報のリスト
+    """
+    page_count = max(1, math.ceil(len(scenes) / GALLERY_PAGE_SIZE))
+
+    # シーン数が変わった場合に備えて範囲内に収める
+    page = min(st.session_state.get("gallery_page", 0), page_count - 1)
+    st.session_state["gallery_page"] = page
+
+    # タイムラインでジャンプ（各ページ先頭シーンの開始時間で選択）
+    if page_count > 1:
+        st.select_slider(
+            "タイムラインでジャンプ",
+            options=list(range(page_count)),
+            format_func=lambda p: scenes[p * GALLERY_PAGE_SIZE].start_timecode,
+            key="gallery_page",
+            on_change=_hide_downloads
+        )
+
+        nav_prev, nav_label, nav_next = st.columns([1, 4, 1])
+        nav_prev.button(
+            "◀ 前へ",
+            disabled=page == 0,
+            on_click=_shift_gallery_page,
+            args=(-1, page_count),
+            use_container_width=True
+        )
+        nav_next.button(
+            "次へ ▶",
+            disabled=page == page_count - 1,
+            on_click=_shift_gallery_page,
+            args=(1, page_count),
+            use_container_width=True
+        )
+        nav_label.markdown(
+            f"<div style='text-align: center'>ページ {page + 1} / {page_count}</div>",
+            unsafe_allow_html=True
+        )
+
+    # 表示中のページのみ描画
+    page_scenes = scenes[page * GALLERY_PAGE_SIZE:(page + 1) * GALLERY_PAGE_SIZE]
+    for i in range(0, len(page_scenes), GALLERY_COLS):
+        cols = st.columns(GALLERY_COLS)
+        for col, scene in zip(cols, page_scenes[i:i + GALLERY_COLS]):
+            with col:
+                if scene.thumbnail_path and os.path.exists(scene.thumbnail_path):
+                    st.image(get_preview_path(scene), use_column_width=True)
+                st.caption(
+                    f"**#{scene.scene_num}** | "
+                    f"{scene.start_timecode} - {scene.end_timecode}\n"
+                    f"({scene.duration:.1f}秒)"
+                )
+
 
 def main():
     st.title("🎬 Movie Insights")
@@ -77,82 +221,157 @@ def main():
     )
 
     if uploaded_file:
-        # 一時ディレクトリを作成
-        temp_dir = tempfile.mkdtemp()
-        video_path = os.path.join(temp_dir, uploaded_file.name)
-        output_dir = os.path.join(temp_dir, "frames")
+        # 一時ディレクトリを作成（再実行のたびに作り直さないようアップロード単位で保持）
+        upload_key = uploaded_file.file_id
+        if st.session_state.get("upload_key") != upload_key:
+            temp_dir = tempfile.mkdtemp()
+            video_path = os.path.join(temp_dir, uploaded_file.name)
 
-        try:
             # 動画を一時ファイルに保存
             with open(video_path, "wb") as f:
                 f.write(uploaded_file.read())
 
-            st.success(f"📹 {uploaded_file.name} をアップロードしました")
+            st.session_state["upload_key"] = upload_key
+            st.session_state["temp_dir"] = temp_dir
+            st.session_state.pop("analysis", None)
 
-            # 分析開始ボタン
-            if st.button("🔍 シーン分析を開始", type="primary"):
-                # 分析処理
-                with st.spinner("シーンを検出中..."):
-                    insights = MovieInsights(
-                        threshold=threshold,
-                        min_scene_len=min_scene_len
-                    )
-                    scenes = insights.detect_scenes(video_path)
+        temp_dir = st.session_state["temp_dir"]
+        video_path = os.path.join(temp_dir, uploaded_file.name)
+        output_dir = os.path.join(temp_dir, "frames")
+
+        st.success(f"📹 {uploaded_file.name} をアップロードしました")
+
+        # 前回の実行がキャンセルされていれば報告する
+        cancel_token = st.session_state.pop("cancel_token", None)
+        if cancel_token and cancel_token.cancelled:
+            st.session_state.pop("analysis", None)
+            st.warning("分析をキャンセルしました")
+
+        # 分析開始ボタン
+        if st.button("🔍 シーン分析を開始", type="primary"):
+            # 分析処理（キャンセルボタンで途中停止できる）
+            # トークンは検出・抽出のフレームループと各出力の前で確認される。
+            # ボタンによる再実行で処理が先に中断された場合も、再実行後に
+            # トークンを見てキャンセルを報告する
+            cancel_token = CancelToken()
+            st.session_state["cancel_token"] = cancel_token
+            progress_bar = st.progress(0.0, text="シーンを検出中...")
+            st.button("⏹ キャンセル", on_click=_cancel_analysis)
+
+            def on_progress(event: ProgressEvent):
+                progress_bar.progress(event.fraction, text=format_progress(event))
+
+            insights = MovieInsights(
+                threshold=threshold,
+                min_scene_len=min_scene_len
+            )
+
+            # ZIPはサムネイル抽出と同時に一時ディレクトリへ書き込む
+            # （セッションにはExcel・PowerPointと同様にパスだけを保持する）
+            exports = {}
+            if export_zip:
+                exports["zip"] = os.path.join(temp_dir, "scene_images.zip")
+
+            try:
+                scenes = insights.detect_scenes(
+                    video_path,
+                    progress_callback=on_progress,
+                    cancel_token=cancel_token
+                )
 
                 if not scenes:
+                    progress_bar.empty()
+                    st.session_state.pop("cancel_token", None)
+                    st.session_state.pop("analysis", None)
                     st.warning("シーンが検出されませんでした。閾値を下げてみてください。")
                     return
 
-                st.success(f"✅ {len(scenes)} シーンを検出しました")
-
                 # サムネイル抽出
-                with st.spinner("サムネイルを抽出中..."):
-                    insights.extract_thumbnails(output_dir)
+                archive = StreamingImageZip(exports["zip"]) if "zip" in exports else None
+                try:
+                    # 閾値を変えて再分析した場合は、前回から変わらないシーンを再利用する
+                    insights.extract_thumbnails(
+                        output_dir,
+                        incremental=True,
+                        thumbnail_callback=archive.add if archive else None,
+                        progress_callback=on_progress,
+                        cancel_token=cancel_token
+                    )
+                finally:
+                    if archive:
+                        archive.close()
 
-                video_info = insights.get_video_info()
+                progress_bar.empty()
 
-                # 結果表示
-                st.markdown("---")
-                st.subheader("📊 動画情報")
-
-                col1, col2, col3, col4 = st.columns(4)
-                col1.metric("総再生時間", video_info["duration_formatted"])
-                col2.metric("FPS", f"{video_info['fps']:.2f}")
-                col3.metric("総フレーム数", f"{video_info['total_frames']:,}")
-                col4.metric("検出シーン数", len(scenes))
-
-                # シーン一覧
-                st.markdown("---")
-                st.subheader("🎞️ シーン一覧")
-
-                # グリッド表示
-                cols_per_row = 4
-                for i in range(0, len(scenes), cols_per_row):
-                    cols = st.columns(cols_per_row)
-                    for j, col in enumerate(cols):
-                        idx = i + j
-                        if idx < len(scenes):
-                            scene = scenes[idx]
-                            with col:
-                                if scene.thumbnail_path and os.path.exists(scene.thumbnail_path):
-                                    st.image(scene.thumbnail_path, use_container_width=True)
-                                st.caption(
-                                    f"**#{scene.scene_num}** | "
-                                    f"{scene.start_timecode} - {scene.end_timecode}\n"
-                                    f"({scene.duration:.1f}秒)"
-                                )
-
-                # ダウンロードセクション
-                st.markdown("---")
-                st.subheader("📥 ダウンロード")
+                video_info = insights.get_video_info()
 
+                # 出力ファイルを生成
+                with st.spinner("出力ファイルを生成中..."):
+                    if export_excel:
+                        cancel_token.raise_if_cancelled()
+                        exports["excel"] = os.path.join(temp_dir, "scene_report.xlsx")
+                        export_to_excel(scenes, video_info, exports["excel"], part_cache=True)
+
+                    if export_pptx:
+                        cancel_token.raise_if_cancelled()
+                        exports["pptx"] = os.path.join(temp_dir, "scene_slides.pptx")
+                        export_to_pptx(scenes, video_info, exports["pptx"])
+            except OperationCancelled:
+                progress_bar.empty()
+                st.session_state.pop("cancel_token", None)
+                st.session_state.pop("analysis", None)
+                st.warning("分析をキャンセルしました")
+                return
+
+            st.session_state.pop("cancel_token", None)
+
+            # ページ送りなどの再実行でも結果を保持する
+            st.session_state["analysis"] = {
+                "scenes": scenes,
+                "video_info": video_info,
+                "exports": exports,
+            }
+            st.session_state["gallery_page"] = 0
+            st.session_state["show_downloads"] = False
+
+        analysis = st.session_state.get("analysis")
+        if analysis:
+            scenes = analysis["scenes"]
+            video_info = analysis["video_info"]
+            exports = analysis["exports"]
+
+            st.success(f"✅ {len(scenes)} シーンを検出しました")
+
+            # 結果表示
+            st.markdown("---")
+            st.subheader("📊 動画情報")
+
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("総再生時間", video_info["duration_formatted"])
+            col2.metric("FPS", f"{video_info['fps']:.2f}")
+            col3.metric("総フレーム数", f"{video_info['total_frames']:,}")
+            col4.metric("検出シーン数", len(scenes))
+
+            # シーン一覧
+            st.markdown("---")
+            st.subheader("🎞️ シーン一覧")
+            render_scene_gallery(scenes)
+
+            # ダウンロードセクション
+            # Note: Streamlitはファイルダウンロード後も状態を保持するため
+            # 一時ディレクトリはここでは削除しない（ユーザーが再ダウンロードできるように）
+            st.markdown("---")
+            st.subheader("📥 ダウンロード")
+
+            # 出力ファイルは大きくなるため、明示的に要求されたときだけ読み込む
+            if not st.session_state.get("show_downloads"):
+                st.button("📥 ダウンロードを準備", on_click=_show_downloads)
+            else:
                 download_cols = st.columns(3)
 
                 # Excel
-                if export_excel:
-                    excel_path = os.path.join(temp_dir, "scene_report.xlsx")
-                    export_to_excel(scenes, video_info, excel_path)
-                    with open(excel_path, "rb") as f:
+                if "excel" in exports:
+                    with open(exports["excel"], "rb") as f:
                         download_cols[0].download_button(
                             "📊 Excel ダウンロード",
                             f.read(),
@@ -161,10 +380,8 @@ def main():
                         )
 
                 # PowerPoint
-                if export_pptx:
-                    pptx_path = os.path.join(temp_dir, "scene_slides.pptx")
-                    export_to_pptx(scenes, video_info, pptx_path)
-                    with open(pptx_path, "rb") as f:
+                if "pptx" in exports:
+                    with open(exports["pptx"], "rb") as f:
                         download_cols[1].download_button(
                             "📽️ PowerPoint ダウンロード",
                             f.read(),
@@ -173,10 +390,8 @@ def main():
                         )
 
                 # ZIP
-                if export_zip:
-                    zip_path = os.path.join(temp_dir, "scene_images.zip")
-                    export_images_zip(scenes, zip_path)
-                    with open(zip_path, "rb") as f:
+                if "zip" in exports:
+                    with open(exports["zip"], "rb") as f:
                         download_cols[2].download_button(
                             "📦 画像ZIP ダウンロード",
                             f.read(),
@@ -184,12 +399,6 @@ def main():
                             mime="application/zip"
                         )
 
-        finally:
-            # セッションが終わったら一時ディレクトリを削除
-            # Note: Streamlitはファイルダウンロード後も状態を保持するため
-            # ここでは削除しない（ユーザーが再ダウンロードできるように）
-            pass
-
     else:
         # アップロード前の説明
         st.markdown("""
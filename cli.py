@@ -9,8 +9,22 @@ from pathlib import Path
 
 import click
 
-from scene_detector import MovieInsights
-from exporters import export_to_excel, export_to_pptx, export_images_zip
+from scene_detector import MovieInsights, SceneInfo, ProgressEvent
+from exporters import export_to_excel, export_to_pptx, export_timeline, StreamingImageZip
+
+
+def echo_progress(event: ProgressEvent):
+    """進捗を1行で上書き表示する"""
+    unit = "フレーム" if event.stage == "detect" else "シーン"
+    line = (
+        f"\r  {event.fraction * 100:5.1f}% "
+        f"({event.processed:,} / {event.total:,} {unit}, {event.fps:.0f} fps"
+    )
+    if event.eta is not None:
+        line += f", 残り {SceneInfo._seconds_to_timecode(event.eta)}"
+    click.echo(line + ")  ", nl=False)
+    if event.processed >= event.total:
+        click.echo()
 
 
 @click.command()
@@ -33,6 +47,11 @@ from exporters import export_to_excel, export_to_pptx, export_images_zip
     default=15,
     help="最小シーン長（フレーム数、デフォルト: 15）"
 )
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="前回の出力を再利用し、新規・変更されたシーンのサムネイルだけ抽出"
+)
 @click.option(
     "--no-excel",
     is_flag=True,
@@ -48,14 +67,21 @@ from exporters import export_to_excel, export_to_pptx, export_images_zip
     is_flag=True,
     help="ZIP出力をスキップ"
 )
+@click.option(
+    "--no-timeline",
+    is_flag=True,
+    help="タイムライン（シーン表・フレームスコアの.npz）出力をスキップ"
+)
 def main(
     video_path: str,
     output: str,
     threshold: float,
     min_scene_len: int,
+    incremental: bool,
     no_excel: bool,
     no_pptx: bool,
-    no_zip: bool
+    no_zip: bool,
+    no_timeline: bool
 ):
     """
     動画ファイルをシーン分析して各種形式で出力する
@@ -86,7 +112,11 @@ def main(
     )
 
     try:
-        scenes = insights.detect_scenes(str(video_path))
+        scenes = insights.detect_scenes(
+            str(video_path),
+            progress_callback=echo_progress,
+            record_scores=not no_timeline
+        )
     except Exception as e:
         click.echo(f"❌ エラー: {e}", err=True)
         raise click.Abort()
@@ -97,9 +127,20 @@ def main(
 
     click.echo(f"✅ {len(scenes)} シーンを検出しました")
 
-    # サムネイル抽出
+    # サムネイル抽出（ZIPは抽出と同時に書き込む）
     click.echo("🖼️ サムネイルを抽出中...")
-    insights.extract_thumbnails(str(frames_dir))
+    zip_path = output_dir / "scene_images.zip"
+    archive = None if no_zip else StreamingImageZip(str(zip_path))
+    try:
+        insights.extract_thumbnails(
+            str(frames_dir),
+            incremental=incremental,
+            thumbnail_callback=archive.add if archive else None,
+            progress_callback=echo_progress
+        )
+    finally:
+        if archive:
+            archive.close()
     click.echo(f"✅ サムネイルを {frames_dir} に保存しました")
 
     video_info = insights.get_video_info()
@@ -118,7 +159,12 @@ def main(
 
     if not no_excel:
         excel_path = output_dir / "scene_report.xlsx"
-        export_to_excel(scenes, video_info, str(excel_path))
+        export_to_excel(
+            scenes,
+            video_info,
+            str(excel_path),
+            part_cache=incremental
+        )
         click.echo(f"  ✅ Excel: {excel_path.name}")
 
     if not no_pptx:
@@ -127,10 +173,13 @@ def main(
         click.echo(f"  ✅ PowerPoint: {pptx_path.name}")
 
     if not no_zip:
-        zip_path = output_dir / "scene_images.zip"
-        export_images_zip(scenes, str(zip_path))
         click.echo(f"  ✅ ZIP: {zip_path.name}")
 
+    if not no_timeline:
+        timeline_path = output_dir / "scene_timeline.npz"
+        export_timeline(scenes, insights.frame_scores, video_info, str(timeline_path))
+        click.echo(f"  ✅ タイムライン: {timeline_path.name}")
+
     click.echo()
     click.echo("🎉 完了！")
     click.echo(f"出力先: {output_dir}")
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+Movie Insights - Watch Folder Daemon
+監視ディレクトリに置かれた動画を自動でシーン分析して出力
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import signal
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import click
+
+from scene_detector import MovieInsights, CancelToken, OperationCancelled
+from exporters import export_to_excel, export_to_pptx, export_timeline, StreamingImageZip
+
+
+VIDEO_EXTENSIONS = {".mp4", ".avi", ".mov", ".mkv", ".webm"}
+LEDGER_FILENAME = ".processed.jsonl"
+
+
+class ProcessedLedger:
+    """
+    処理済みファイルの台帳
+
+    出力ディレクトリ内のJSON Lines形式ファイルに1行1件で追記する。
+    パス・サイズ・更新時刻が同じファイルは再起動後も処理済みとして扱う
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._keys: Set[str] = set()
+
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self._keys.add(json.loads(line)["key"])
+                    except (ValueError, KeyError):
+                        # 書き込み途中で止まった行は無視する
+                        continue
+
+    @staticmethod
+    def make_key(video_path: Path, stat: os.stat_result) -> str:
+        """台帳のキー（パス・サイズ・更新時刻）を作成"""
+        return f"{video_path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._keys
+
+    def add(self, key: str, video_path: Path, output_dir: Path):
+        """処理済みとして記録（fsyncまで行う）"""
+        record = {
+            "key": key,
+            "path": str(video_path),
+            "output": str(output_dir),
+            "processed_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._keys.add(key)
+
+
+def output_dir_name(video_path: Path) -> str:
+    """
+    動画ごとの出力ディレクトリ名を作成
+
+    同じファイル名（拡張子違いや別の監視ディレクトリ）の動画が
+    同じ出力先を取り合わないよう、パスのハッシュを付ける
+    """
+    digest = hashlib.sha1(str(video_path.resolve()).encode("utf-8")).hexdigest()[:8]
+    return f"{video_path.stem}-{digest}"
+
+
+def _make_work_dir(output_root: Path, name: str, kind: str) -> Path:
+    """
+    出力ルート内に一意な作業用ディレクトリを作成
+
+    tempfile.mkdtemp() は権限を 0700 にするため、公開後のレポートを
+    他のユーザーが読めるよう、通常の mkdir で umask に従って作成する。
+    名前は ".<出力名>.<kind>-<ランダム>" で、起動時の掃除の対象になる
+    """
+    while True:
+        path = output_root / f".{name}.{kind}-{uuid.uuid4().hex[:8]}"
+        try:
+            path.mkdir()
+            return path
+        except FileExistsError:
+            continue
+
+
+def cleanup_work_dirs(output_root: Path):
+    """強制終了などで残った作業用ディレクトリを削除する"""
+    for path in output_root.iterdir():
+        if (
+            path.is_dir()
+            and path.name.startswith(".")
+            and (".work-" in path.name or ".old-" in path.name)
+        ):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def process_video(
+    video_path: Path,
+    output_root: Path,
+    threshold: float,
+    min_scene_len: int,
+    excel: bool = True,
+    pptx: bool = True,
+    images_zip: bool = True,
+    timeline: bool = True,
+    cancel_token: Optional[CancelToken] = None
+) -> Path:
+    """
+    動画1本を分析して出力ディレクトリに書き出す
+
+    作業は出力ルート内の一時ディレクトリで行い、完了後にリネームで
+    置き換えるため、途中の状態の出力が見えることはない
+
+    Args:
+        video_path: 動画ファイルのパス
+        output_root: 出力ルートディレクトリ
+        threshold: シーン検出の閾値
+        min_scene_len: 最小シーン長（フレーム数）
+        excel: Excelを出力するか
+        pptx: PowerPointを出力するか
+        images_zip: 画像ZIPを出力するか
+        timeline: タイムライン（.npz）を出力するか
+        cancel_token: キャンセル要求を受け取るトークン
+
+    Returns:
+        出力ディレクトリのパス
+
+    Raises:
+        OperationCancelled: 処理中にキャンセルされた場合
+    """
+    name = output_dir_name(video_path)
+    final_dir = output_root / name
+    work_dir = _make_work_dir(output_root, name, "work")
+
+    try:
+        insights = MovieInsights(
+            threshold=threshold,
+            min_scene_len=min_scene_len
+        )
+        scenes = insights.detect_scenes(
+            str(video_path),
+            cancel_token=cancel_token,
+            record_scores=timeline
+        )
+
+        # ZIPは抽出と同時に書き込む
+        archive = StreamingImageZip(str(work_dir / "scene_images.zip")) if images_zip else None
+        try:
+            if scenes:
+                insights.extract_thumbnails(
+                    str(work_dir / "frames"),
+                    thumbnail_callback=archive.add if archive else None,
+                    cancel_token=cancel_token
+                )
+        finally:
+            if archive:
+                archive.close()
+
+        video_info = insights.get_video_info()
+
+        if excel:
+            export_to_excel(scenes, video_info, str(work_dir / "scene_report.xlsx"))
+        if pptx:
+            export_to_pptx(scenes, video_info, str(work_dir / "scene_slides.pptx"))
+        if timeline:
+            export_timeline(
+                scenes,
+                insights.frame_scores,
+                video_info,
+                str(work_dir / "scene_timeline.npz")
+            )
+
+        # 既存の出力は退避してから置き換える
+        old_dir = None
+        if final_dir.exists():
+            old_dir = _make_work_dir(output_root, name, "old")
+            os.replace(final_dir, old_dir / final_dir.name)
+        os.replace(work_dir, final_dir)
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+    return final_dir
+
+
+class WatchDaemon:
+    """監視ディレクトリをポーリングして新しい動画を処理する"""
+
+    def __init__(
+        self,
+        watch_dirs: List[Path],
+        output_root: Path,
+        jobs: int = 1,
+        interval: float = 5.0,
+        stable_checks: int = 2,
+        **job_options
+    ):
+        """
+        Args:
+            watch_dirs: 監視するディレクトリのリスト
+            output_root: 出力ルートディレクトリ
+            jobs: 同時に実行する分析ジョブ数
+            interval: ポーリング間隔（秒）
+            stable_checks: 書き込み完了とみなすまでにサイズが変わらない回数
+            job_options: process_video() に渡す追加オプション
+        """
+        self.watch_dirs = watch_dirs
+        self.output_root = output_root
+        self.jobs = jobs
+        self.interval = interval
+        self.stable_checks = stable_checks
+        self.job_options = job_options
+
+        self.ledger = ProcessedLedger(output_root / LEDGER_FILENAME)
+        # 前回の強制終了で残った作業用ディレクトリを片付ける
+        # （同じ出力ルートを複数のデーモンで共有しない前提）
+        cleanup_work_dirs(output_root)
+        self._stop = threading.Event()
+        self._cancel_token = CancelToken()
+        self._lock = threading.Lock()
+        # path -> (size, mtime_ns, 連続して変化がなかった回数)
+        self._pending: Dict[Path, Tuple[int, int, int]] = {}
+        self._in_flight: Set[Path] = set()
+        # 今回の起動中に失敗したキー（再起動すると再試行される）
+        self._failed: Set[str] = set()
+        # 読み込めなくなっている監視ディレクトリ（ログを重複させないため）
+        self._unreadable: Set[Path] = set()
+
+    def stop(self):
+        """
+        監視を停止する
+
+        実行中のジョブはキャンセルされ、台帳には記録されないため
+        次回起動時に最初から処理し直される
+        """
+        self._stop.set()
+        self._cancel_token.cancel()
+
+    def _scan(self) -> List[Path]:
+        """監視ディレクトリ内の動画ファイルを列挙"""
+        videos = []
+        for watch_dir in self.watch_dirs:
+            try:
+                entries = sorted(watch_dir.iterdir())
+            except OSError as e:
+                # アンマウントや削除されたディレクトリは次回のポーリングで再確認する
+                if watch_dir not in self._unreadable:
+                    self._unreadable.add(watch_dir)
+                    click.echo(f"⚠️ 監視ディレクトリを読み込めません: {watch_dir}: {e}", err=True)
+                continue
+
+            if watch_dir in self._unreadable:
+                self._unreadable.discard(watch_dir)
+                click.echo(f"✅ 監視ディレクトリを再開しました: {watch_dir}")
+
+            for path in entries:
+                if (
+                    path.is_file()
+                    and not path.name.startswith(".")
+                    and path.suffix.lower() in VIDEO_EXTENSIONS
+                ):
+                    videos.append(path.resolve())
+        return videos
+
+    def _poll(self) -> List[Tuple[Path, str]]:
+        """書き込みが完了し、未処理の動画を返す"""
+        ready = []
+        seen = set()
+
+        for path in self._scan():
+            seen.add(path)
+            with self._lock:
+                if path in self._in_flight:
+                    continue
+
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+
+            key = ProcessedLedger.make_key(path, stat)
+            with self._lock:
+                failed = key in self._failed
+            if key in self.ledger or failed:
+                self._pending.pop(path, None)
+                continue
+
+            # サイズと更新時刻が一定回数変わらなければ書き込み完了とみなす
+            size, mtime_ns, count = self._pending.get(path, (-1, -1, 0))
+            if (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns):
+                count += 1
+            else:
+                count = 0
+            self._pending[path] = (stat.st_size, stat.st_mtime_ns, count)
+
+            if count >= self.stable_checks:
+                del self._pending[path]
+                ready.append((path, key))
+
+        # 消えたファイルは追跡をやめる
+        for path in list(self._pending):
+            if path not in seen:
+                del self._pending[path]
+
+        return ready
+
+    def _run_job(self, video_path: Path, key: str):
+        """ジョブを実行して台帳に記録"""
+        try:
+            click.echo(f"🔍 分析開始: {video_path.name}")
+            output_dir = process_video(
+                video_path,
+                self.output_root,
+                cancel_token=self._cancel_token,
+                **self.job_options
+            )
+            self.ledger.add(key, video_path, output_dir)
+            click.echo(f"✅ 完了: {video_path.name} -> {output_dir}")
+        except OperationCancelled:
+            click.echo(f"⏹ キャンセル: {video_path.name}")
+        except Exception as e:
+            with self._lock:
+                self._failed.add(key)
+            click.echo(f"❌ エラー: {video_path.name}: {e}", err=True)
+        finally:
+            with self._lock:
+                self._in_flight.discard(video_path)
+
+    def run(self):
+        """停止されるまで監視を続ける"""
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            try:
+                while not self._stop.is_set():
+                    for video_path, key in self._poll():
+                        with self._lock:
+                            self._in_flight.add(video_path)
+                        executor.submit(self._run_job, video_path, key)
+                    self._stop.wait(self.interval)
+            except KeyboardInterrupt:
+                # 実行中のジョブを止めてから終了を待つ
+                self.stop()
+
+
+@click.command()
+@click.argument(
+    "watch_dirs",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, file_okay=False)
+)
+@click.option(
+    "-o", "--output",
+    type=click.Path(file_okay=False),
+    default="./output",
+    help="出力ルートディレクトリ（動画ごとにサブディレクトリを作成、デフォルト: ./output）"
+)
+@click.option(
+    "-t", "--threshold",
+    type=float,
+    default=27.0,
+    help="検出感度の閾値（10-50、低いほど多く検出、デフォルト: 27.0）"
+)
+@click.option(
+    "-m", "--min-scene-len",
+    type=int,
+    default=15,
+    help="最小シーン長（フレーム数、デフォルト: 15）"
+)
+@click.option(
+    "-j", "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="同時に処理する動画数（デフォルト: 1）"
+)
+@click.option(
+    "-i", "--interval",
+    type=click.FloatRange(min=0.1),
+    default=5.0,
+    help="ポーリング間隔（秒、デフォルト: 5.0）"
+)
+@click.option(
+    "--stable-checks",
+    type=click.IntRange(min=1),
+    default=2,
+    help="書き込み完了とみなすまでにサイズが変わらない回数（デフォルト: 2）"
+)
+@click.option(
+    "--no-excel",
+    is_flag=True,
+    help="Excel出力をスキップ"
+)
+@click.option(
+    "--no-pptx",
+    is_flag=True,
+    help="PowerPoint出力をスキップ"
+)
+@click.option(
+    "--no-zip",
+    is_flag=True,
+    help="ZIP出力をスキップ"
+)
+@click.option(
+    "--no-timeline",
+    is_flag=True,
+    help="タイムライン（シーン表・フレームスコアの.npz）出力をスキップ"
+)
+def main(
+    watch_dirs: Tuple[str, ...],
+    output: str,
+    threshold: float,
+    min_scene_len: int,
+    jobs: int,
+    interval: float,
+    stable_checks: int,
+    no_excel: bool,
+    no_pptx: bool,
+    no_zip: bool,
+    no_timeline: bool
+):
+    """
+    監視ディレクトリに追加された動画を自動でシーン分析する
+
+    WATCH_DIRS: 監視するディレクトリ（複数指定可）
+    """
+    dirs = [Path(d).resolve() for d in watch_dirs]
+    output_root = Path(output).resolve()
+    output_root.mkdir(parents=True, exist_ok=True)
+
+    click.echo(f"🎬 Movie Insights - Watch Mode")
+    click.echo(f"=" * 50)
+    for d in dirs:
+        click.echo(f"監視: {d}")
+    click.echo(f"出力: {output_root}")
+    click.echo(f"同時実行数: {jobs}")
+    click.echo()
+
+    daemon = WatchDaemon(
+        dirs,
+        output_root,
+        jobs=jobs,
+        interval=interval,
+        stable_checks=stable_checks,
+        threshold=threshold,
+        min_scene_len=min_scene_len,
+        excel=not no_excel,
+        pptx=not no_pptx,
+        images_zip=not no_zip,
+        timeline=not no_timeline
+    )
+
+    # SIGTERMでもCtrl+Cと同様に実行中のジョブを止めて終了する
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+
+    daemon.run()
+
+    click.echo("👋 監視を終了しました")
+
+
+if __name__ == "__main__":
+    main()
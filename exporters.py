@@ -4,9 +4,12 @@ Excel・PowerPoint出力機能
 """
 
 import io
+import struct
 import zipfile
 from pathlib import Path
-from typing import List, Tuple
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+import numpy as np
 
 from openpyxl import Workbook
 from openpyxl.drawing.image import Image as XLImage
@@ -18,14 +21,46 @@ from pptx.util import Inches, Pt
 from pptx.dml.color import RGBColor
 from pptx.enum.text import PP_ALIGN
 
-from scene_detector import SceneInfo
+from scene_detector import SceneInfo, PARTS_DIRNAME
+
+
+def _resized_thumbnail_png(
+    scene: SceneInfo,
+    size: Tuple[int, int],
+    part_cache: bool = False
+) -> bytes:
+    """
+    リサイズしたサムネイルのPNGデータを取得する
+
+    part_cache=True の場合は結果をサムネイルと同じディレクトリの .parts/ に
+    フレーム範囲をキーとして保存するため、差分抽出でシーン番号が付け替わっても
+    再実行時にそのまま再利用できる。元のサムネイルの方が新しい場合は作り直す
+    """
+    source = Path(scene.thumbnail_path)
+    part = source.parent / PARTS_DIRNAME / (
+        f"{scene.start_frame}-{scene.end_frame}_{size[0]}x{size[1]}.png"
+    )
+    if part_cache and part.exists() and part.stat().st_mtime >= source.stat().st_mtime:
+        return part.read_bytes()
+
+    with Image.open(source) as img:
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+        img_buffer = io.BytesIO()
+        img.save(img_buffer, format="PNG")
+
+    data = img_buffer.getvalue()
+    if part_cache:
+        part.parent.mkdir(exist_ok=True)
+        part.write_bytes(data)
+    return data
 
 
 def export_to_excel(
     scenes: List[SceneInfo],
     video_info: dict,
     output_path: str,
-    thumbnail_size: Tuple[int, int] = (160, 90)
+    thumbnail_size: Tuple[int, int] = (160, 90),
+    part_cache: bool = False
 ) -> str:
     """
     シーン一覧をExcelファイルに出力
@@ -35,6 +70,7 @@ def export_to_excel(
         video_info: 動画の基本情報
         output_path: 出力ファイルパス
         thumbnail_size: サムネイルサイズ (width, height)
+        part_cache: リサイズ済みサムネイルをシーン単位でキャッシュし、再実行時に再利用する
 
     Returns:
         出力ファイルパス
@@ -80,15 +116,8 @@ def export_to_excel(
         # サムネイル
         ws.cell(row=i, column=2).border = border
         if scene.thumbnail_path and Path(scene.thumbnail_path).exists():
-            # サムネイルをリサイズして挿入
-            img = Image.open(scene.thumbnail_path)
-            img.thumbnail(thumbnail_size, Image.Resampling.LANCZOS)
-
-            # 一時ファイルに保存
-            img_buffer = io.BytesIO()
-            img.save(img_buffer, format="PNG")
-            img_buffer.seek(0)
-
+            # リサイズ済みのサムネイルを挿入
+            img_buffer = io.BytesIO(_resized_thumbnail_png(scene, thumbnail_size, part_cache))
             xl_img = XLImage(img_buffer)
             ws.add_image(xl_img, f"B{i}")
 
@@ -260,22 +289,169 @@ def export_to_pptx(
 
 def export_images_zip(
     scenes: List[SceneInfo],
-    output_path: str
-) -> str:
+    output_path: Union[str, BinaryIO]
+) -> Union[str, BinaryIO]:
     """
-    サムネイル画像をZIPファイルに圧縮
+    サムネイル画像をZIPファイルにまとめる
+
+    JPEGは圧縮済みのため、再圧縮せずに無圧縮（STORED）で格納する
 
     Args:
         scenes: シーン情報のリスト
-        output_path: 出力ファイルパス
+        output_path: 出力ファイルパス、または書き込み可能なファイルオブジェクト
 
     Returns:
-        出力ファイルパス
+        出力ファイルパス（またはファイルオブジェクト）
     """
-    with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zf:
+    with StreamingImageZip(output_path) as archive:
         for scene in scenes:
             if scene.thumbnail_path and Path(scene.thumbnail_path).exists():
-                arcname = Path(scene.thumbnail_path).name
-                zf.write(scene.thumbnail_path, arcname)
+                archive.add(scene, Path(scene.thumbnail_path).read_bytes())
+
+    return output_path
+
+
+class StreamingImageZip:
+    """
+    サムネイル画像を生成と同時にZIPへ追記する
+
+    MovieInsights.extract_thumbnails() の thumbnail_callback に add を渡すと、
+    抽出が終わった時点でZIPも完成しているため、画像を読み直す必要がない。
+    出力先はシーク不可能なストリームでもよい
+
+    使用例:
+        with StreamingImageZip("scene_images.zip") as archive:
+            insights.extract_thumbnails(frames_dir, thumbnail_callback=archive.add)
+    """
+
+    def __init__(self, output: Union[str, BinaryIO]):
+        """
+        Args:
+            output: 出力ファイルパス、または書き込み可能なファイルオブジェクト
+        """
+        self._zf = zipfile.ZipFile(output, "w", zipfile.ZIP_STORED)
+
+    def add(self, scene: SceneInfo, data: bytes):
+        """
+        画像データを1件追記する
+
+        Args:
+            scene: サムネイルパスが設定されたシーン情報
+            data: エンコード済みの画像データ
+        """
+        arcname = Path(scene.thumbnail_path).name
+        self._zf.writestr(arcname, data)
+
+    def close(self):
+        """中央ディレクトリを書き込んでZIPを閉じる"""
+        self._zf.close()
+
+    def __enter__(self) -> "StreamingImageZip":
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# タイムラインのシーン表（1行1シーン）
+TIMELINE_SCENE_DTYPE = np.dtype([
+    ("scene_num", "<i4"),
+    ("start_frame", "<i8"),
+    ("end_frame", "<i8"),
+    ("start_time", "<f8"),
+    ("end_time", "<f8"),
+])
+
+
+def export_timeline(
+    scenes: List[SceneInfo],
+    frame_scores: Optional[np.ndarray],
+    video_info: dict,
+    output_path: str
+) -> str:
+    """
+    シーン表とフレームごとのスコアをNumPyの.npz形式で出力
+
+    メンバーは無圧縮で格納するため、load_timeline() でファイルを
+    コピーせずにメモリマップして読み込める
+
+    Args:
+        scenes: シーン情報のリスト
+        frame_scores: フレームごとのコンテンツスコア（record_scores=True で検出した MovieInsights.frame_scores）
+        video_info: 動画の基本情報
+        output_path: 出力ファイルパス（.npz）
+
+    Returns:
+        出力ファイルパス
+    """
+    scene_table = np.array(
+        [
+            (s.scene_num, s.start_frame, s.end_frame, s.start_time, s.end_time)
+            for s in scenes
+        ],
+        dtype=TIMELINE_SCENE_DTYPE
+    )
+    if frame_scores is None:
+        frame_scores = np.empty(0, dtype=np.float32)
+
+    with open(output_path, "wb") as f:
+        np.savez(
+            f,
+            scenes=scene_table,
+            frame_scores=np.ascontiguousarray(frame_scores, dtype=np.float32),
+            fps=np.float64(video_info.get("fps", 0.0)),
+            total_frames=np.int64(video_info.get("total_frames", 0))
+        )
     return output_path
+
+
+def load_timeline(path: str) -> Dict[str, np.ndarray]:
+    """
+    export_timeline() で出力した.npzを読み込む
+
+    無圧縮のメンバーは読み取り専用のメモリマップとして返すため、
+    大きなタイムラインでもファイル全体を読み込まない
+
+    Args:
+        path: .npzファイルのパス
+
+    Returns:
+        メンバー名（scenes, frame_scores, fps, total_frames）をキーとする配列の辞書
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            name = info.filename[:-len(".npy")] if info.filename.endswith(".npy") else info.filename
+
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zf.open(info) as member:
+                    arrays[name] = np.load(member)
+                continue
+
+            # ローカルファイルヘッダ（30バイト + ファイル名 + 拡張フィールド）の後にデータが続く
+            f.seek(info.header_offset)
+            local_header = f.read(30)
+            name_len, extra_len = struct.unpack("<HH", local_header[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if dtype.hasobject or len(shape) == 0 or np.prod(shape) == 0:
+                with zf.open(info) as member:
+                    arrays[name] = np.load(member)
+                continue
+
+            arrays[name] = np.memmap(
+                path,
+                dtype=dtype,
+                mode="r",
+                shape=shape,
+                order="F" if fortran_order else "C",
+                offset=f.tell()
+            )
+
+    return arrays
@@ -3,13 +3,19 @@ Movie Insights - Scene Detection Core
 シーン検出とフレーム抽出のコア機能
 """
 
+import json
 import os
+import threading
+import time
+from collections import deque
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, List
+from typing import Callable, Dict, Optional, List, Set, Tuple
 
 import cv2
-from scenedetect import open_video, SceneManager, ContentDetector
+import numpy as np
+from scenedetect import open_video, SceneManager, ContentDetector, StatsManager
+from scenedetect.scene_detector import SceneDetector
 
 
 @dataclass
@@ -46,6 +52,196 @@ class SceneInfo:
         return f"{h:02d}:{m:02d}:{s:05.2f}"
 
 
+class OperationCancelled(Exception):
+    """処理がキャンセルされたときに送出される例外"""
+
+
+class CancelToken:
+    """
+    処理のキャンセル要求を伝えるトークン
+
+    別スレッド（UIのボタンやシグナルハンドラなど）から cancel() を呼ぶと、
+    処理中のループが次のフレームで停止する
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        """キャンセルを要求する"""
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        """キャンセルが要求されているか"""
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        """キャンセルが要求されていれば OperationCancelled を送出"""
+        if self.cancelled:
+            raise OperationCancelled("処理がキャンセルされました")
+
+
+@dataclass
+class ProgressEvent:
+    """進捗通知の内容"""
+    stage: str            # "detect"（シーン検出）または "thumbnails"（サムネイル抽出）
+    processed: int        # 処理済み数（detect: フレーム数、thumbnails: シーン数）
+    total: int            # 全体の数
+    fps: float            # 直近のデコード速度（フレーム/秒）
+    elapsed: float        # 経過時間（秒）
+    eta: Optional[float]  # 残り時間の見込み（秒）、速度が不明な間はNone
+
+    @property
+    def fraction(self) -> float:
+        """進捗率（0.0-1.0）"""
+        if self.total <= 0:
+            return 0.0
+        return min(self.processed / self.total, 1.0)
+
+
+ProgressCallback = Callable[[ProgressEvent], None]
+ThumbnailCallback = Callable[[SceneInfo, bytes], None]
+
+
+class _ProgressReporter:
+    """処理速度とETAを計算し、一定間隔でコールバックを呼ぶ"""
+
+    def __init__(
+        self,
+        stage: str,
+        total: int,
+        callback: Optional[ProgressCallback],
+        interval: float = 0.5
+    ):
+        self.stage = stage
+        self.total = total
+        self.callback = callback
+        self.interval = interval
+        self._start = time.monotonic()
+        self._last_time = self._start
+        self._last_frames = 0
+        self._fps = 0.0
+
+    def update(self, processed: int, frames: int, force: bool = False):
+        """
+        Args:
+            processed: 処理済み数
+            frames: これまでにデコードしたフレーム数
+            force: 間隔に関わらず通知する
+        """
+        if self.callback is None:
+            return
+
+        now = time.monotonic()
+        if not force and now - self._last_time < self.interval:
+            return
+
+        # 直近区間の速度を指数移動平均で平滑化
+        if now > self._last_time:
+            current = (frames - self._last_frames) / (now - self._last_time)
+            self._fps = current if self._fps == 0.0 else 0.7 * self._fps + 0.3 * current
+        self._last_time = now
+        self._last_frames = frames
+
+        eta = None
+        elapsed = now - self._start
+        if processed > 0 and elapsed > 0:
+            eta = max(self.total - processed, 0) * elapsed / processed
+
+        self.callback(ProgressEvent(
+            stage=self.stage,
+            processed=processed,
+            total=self.total,
+            fps=self._fps,
+            elapsed=elapsed,
+            eta=eta
+        ))
+
+
+class _FrameMonitor(SceneDetector):
+    """
+    シーン検出ループの各フレームで進捗通知とキャンセル確認を行う検出器
+
+    シーンの区切りは返さず、SceneManagerのフレームループへのフックとしてだけ使う
+    """
+
+    def __init__(
+        self,
+        scene_manager: SceneManager,
+        reporter: _ProgressReporter,
+        cancel_token: Optional[CancelToken]
+    ):
+        super().__init__()
+        self._scene_manager = scene_manager
+        self._reporter = reporter
+        self._cancel_token = cancel_token
+        self._frames = 0
+        # コールバックで発生した例外（detect_scenes() の終了後に送出し直す）
+        self.error: Optional[BaseException] = None
+
+    def process_frame(self, frame_num, frame_img) -> List[int]:
+        if self.error is not None:
+            return []
+        if self._cancel_token and self._cancel_token.cancelled:
+            self._scene_manager.stop()
+            return []
+
+        self._frames += 1
+        try:
+            self._reporter.update(frame_num + 1, self._frames)
+        except BaseException as e:
+            # ここで例外を送出するとSceneManagerがフレームキューを空にせずに抜け、
+            # デコードスレッドが put() で止まったまま残るため、停止だけ要求して
+            # 正常に終了させてから送出し直す
+            self.error = e
+            self._scene_manager.stop()
+        return []
+
+
+# 候補フレームの採点に使う縮小画像の幅（ピクセル）
+CANDIDATE_WIDTH = 160
+
+# サムネイル出力ディレクトリに保存する前回実行の記録
+MANIFEST_FILENAME = ".manifest.json"
+
+# サムネイル出力ディレクトリ内の、フレーム範囲をキーとするシーン単位のキャッシュ
+# （exporters のリサイズ済みサムネイル、app のギャラリー用プレビュー）
+PARTS_DIRNAME = ".parts"
+PREVIEWS_DIRNAME = "previews"
+
+
+def score_candidates(gray_frames: np.ndarray) -> np.ndarray:
+    """
+    候補フレームをまとめて採点する（高いほどサムネイル向き）
+
+    ラプラシアンの分散で鮮明さを測り、明るさが中間から外れるほど、
+    また白飛び・黒つぶれの画素が多いほど減点する
+
+    Args:
+        gray_frames: 縮小したグレースケール画像を重ねた配列 (N, H, W)
+
+    Returns:
+        各候補のスコア (N,)
+    """
+    frames = gray_frames.astype(np.float32)
+    n = len(frames)
+
+    # 4近傍ラプラシアンを全候補に一括で適用
+    laplacian = (
+        frames[:, :-2, 1:-1] + frames[:, 2:, 1:-1]
+        + frames[:, 1:-1, :-2] + frames[:, 1:-1, 2:]
+        - 4 * frames[:, 1:-1, 1:-1]
+    )
+    sharpness = laplacian.reshape(n, -1).var(axis=1)
+
+    flat = frames.reshape(n, -1)
+    exposure = 1.0 - np.abs(flat.mean(axis=1) / 255.0 - 0.5) * 2.0
+    clipped = ((flat < 8) | (flat > 247)).mean(axis=1)
+
+    return np.log1p(sharpness) * (0.5 + 0.5 * exposure) * (1.0 - clipped)
+
+
 class MovieInsights:
     """動画分析のメインクラス"""
 
@@ -66,16 +262,31 @@ class MovieInsights:
         self.fps: float = 0.0
         self.total_frames: int = 0
         self.duration: float = 0.0
+        # フレームごとのコンテンツスコア（ContentDetectorの content_val、record_scores=True の場合のみ）
+        self.frame_scores: Optional[np.ndarray] = None
 
-    def detect_scenes(self, video_path: str) -> List[SceneInfo]:
+    def detect_scenes(
+        self,
+        video_path: str,
+        progress_callback: Optional[ProgressCallback] = None,
+        cancel_token: Optional[CancelToken] = None,
+        record_scores: bool = False
+    ) -> List[SceneInfo]:
         """
         動画からシーンを検出する
 
         Args:
             video_path: 動画ファイルのパス
+            progress_callback: 進捗を受け取るコールバック
+            cancel_token: キャンセル要求を受け取るトークン
+            record_scores: フレームごとのスコアを frame_scores に記録する
+                （StatsManagerを使うため検出が遅くなる。タイムライン出力時のみ有効にする）
 
         Returns:
             検出されたシーン情報のリスト
+
+        Raises:
+            OperationCancelled: 処理中にキャンセルされた場合
         """
         self.video_path = video_path
 
@@ -85,8 +296,9 @@ class MovieInsights:
         self.total_frames = video.duration.get_frames()
         self.duration = self.total_frames / self.fps
 
-        # シーンマネージャーを設定
-        scene_manager = SceneManager()
+        # シーンマネージャーを設定（必要な場合のみフレームごとのスコアも記録する）
+        stats_manager = StatsManager() if record_scores else None
+        scene_manager = SceneManager(stats_manager=stats_manager)
         scene_manager.add_detector(
             ContentDetector(
                 threshold=self.threshold,
@@ -94,9 +306,23 @@ class MovieInsights:
             )
         )
 
+        reporter = _ProgressReporter("detect", self.total_frames, progress_callback)
+        monitor = None
+        if progress_callback or cancel_token:
+            monitor = _FrameMonitor(scene_manager, reporter, cancel_token)
+            scene_manager.add_detector(monitor)
+
         # シーン検出を実行
         scene_manager.detect_scenes(video)
+        if monitor and monitor.error is not None:
+            raise monitor.error
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        reporter.update(self.total_frames, self.total_frames, force=True)
         scene_list = scene_manager.get_scene_list()
+        self.frame_scores = None
+        if stats_manager is not None:
+            self.frame_scores = self._collect_frame_scores(stats_manager)
 
         # シーン情報を変換
         self.scenes = []
@@ -112,20 +338,51 @@ class MovieInsights:
 
         return self.scenes
 
+    def _collect_frame_scores(self, stats_manager: StatsManager) -> np.ndarray:
+        """StatsManagerからフレームごとのスコアを取り出す（未計測のフレームはNaN）"""
+        key = ContentDetector.FRAME_SCORE_KEY
+        scores = np.full(self.total_frames, np.nan, dtype=np.float32)
+        for frame_num in range(self.total_frames):
+            if stats_manager.metrics_exist(frame_num, [key]):
+                scores[frame_num] = stats_manager.get_metrics(frame_num, [key])[0]
+        return scores
+
     def extract_thumbnails(
         self,
         output_dir: str,
-        position: float = 0.3
+        position: float = 0.3,
+        candidates: int = 5,
+        window: float = 1.0,
+        incremental: bool = False,
+        thumbnail_callback: Optional[ThumbnailCallback] = None,
+        progress_callback: Optional[ProgressCallback] = None,
+        cancel_token: Optional[CancelToken] = None
     ) -> List[SceneInfo]:
         """
         各シーンから代表フレーム（サムネイル）を抽出する
 
+        抽出位置の前後 window 秒から candidates 枚の候補を1回のデコードで集め、
+        ブレやフェードの少ないフレームを選ぶ。
+
+        incremental=True の場合は出力ディレクトリの前回のマニフェストと
+        フレーム範囲で突き合わせ、範囲が変わらないシーンは再エンコードせず
+        ファイル名の付け替えだけで再利用する
+
         Args:
             output_dir: 出力ディレクトリ
             position: シーン内の抽出位置（0.0-1.0、デフォルトは30%地点）
+            candidates: 位置ごとの候補フレーム数（1で指定位置のフレームをそのまま使う）
+            window: 候補を探す範囲（秒）
+            incremental: 前回の出力を再利用して、新規・変更されたシーンだけ抽出する
+            thumbnail_callback: サムネイルを保存するたびに (シーン, JPEGデータ) で呼ばれるコールバック
+            progress_callback: 進捗を受け取るコールバック
+            cancel_token: キャンセル要求を受け取るトークン
 
         Returns:
             サムネイルパスが設定されたシーン情報のリスト
+
+        Raises:
+            OperationCancelled: 処理中にキャンセルされた場合
         """
         if not self.video_path or not self.scenes:
             raise ValueError("先にdetect_scenes()を実行してください")
@@ -134,30 +391,232 @@ class MovieInsights:
         output_path = Path(output_dir)
         output_path.mkdir(parents=True, exist_ok=True)
 
+        # マニフェストの照合に使う入力と抽出条件
+        video_stat = os.stat(self.video_path)
+        manifest = {
+            "video": {
+                "path": os.path.abspath(self.video_path),
+                "size": video_stat.st_size,
+                "mtime_ns": video_stat.st_mtime_ns,
+            },
+            "params": {
+                "position": position,
+                "candidates": candidates,
+                "window": window,
+            },
+        }
+        manifest_path = output_path / MANIFEST_FILENAME
+
+        previous = None
+        if incremental:
+            try:
+                with open(manifest_path, encoding="utf-8") as f:
+                    previous = json.load(f)
+            except (OSError, ValueError):
+                previous = None
+
+        # 書き換えの途中で中断しても古い対応関係が使われないよう、先に削除する
+        manifest_path.unlink(missing_ok=True)
+
+        reused: Set[int] = set()
+        if previous:
+            reused = self._reuse_thumbnails(output_path, previous, manifest)
+        self._prune_scene_caches(output_path)
+
         # 動画を開く
         cap = cv2.VideoCapture(self.video_path)
+        reporter = _ProgressReporter("thumbnails", len(self.scenes), progress_callback)
+        frames_decoded = 0
 
         try:
-            for scene in self.scenes:
-                # 抽出するフレーム位置を計算
-                frame_range = scene.end_frame - scene.start_frame
-                target_frame = scene.start_frame + int(frame_range * position)
+            for done, scene in enumerate(self.scenes):
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                reporter.update(done, frames_decoded)
 
-                # フレームを取得
-                cap.set(cv2.CAP_PROP_POS_FRAMES, target_frame)
-                ret, frame = cap.read()
+                if scene.scene_num in reused:
+                    # 再利用したサムネイルはデコードせず、ファイルの内容をそのまま渡す
+                    if thumbnail_callback:
+                        thumbnail_callback(scene, Path(scene.thumbnail_path).read_bytes())
+                    continue
 
-                if ret:
+                data, decoded = self._read_best_frame(cap, scene, position, candidates, window)
+                frames_decoded += decoded
+
+                if data is not None:
                     # サムネイルを保存
                     filename = f"scene_{scene.scene_num:04d}.jpg"
                     filepath = output_path / filename
-                    cv2.imwrite(str(filepath), frame)
+                    with open(filepath, "wb") as f:
+                        f.write(data)
                     scene.thumbnail_path = str(filepath)
+
+                    # エンコード済みのJPEGをそのまま渡す（ZIPへの逐次書き込みなど）
+                    if thumbnail_callback:
+                        thumbnail_callback(scene, data)
+
+            reporter.update(len(self.scenes), frames_decoded, force=True)
         finally:
             cap.release()
 
+        # 次回の差分抽出のためにマニフェストを書き込む
+        manifest["scenes"] = [
+            {
+                "start_frame": scene.start_frame,
+                "end_frame": scene.end_frame,
+                "file": Path(scene.thumbnail_path).name,
+            }
+            for scene in self.scenes
+            if scene.thumbnail_path
+        ]
+        tmp_path = manifest_path.with_name(manifest_path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+
         return self.scenes
 
+    def _reuse_thumbnails(
+        self,
+        output_path: Path,
+        previous: dict,
+        manifest: dict
+    ) -> Set[int]:
+        """
+        前回のマニフェストとフレーム範囲が一致するシーンのサムネイルを再利用する
+
+        再利用するファイルは新しいシーン番号に付け替え、範囲が一致しなくなった
+        古いファイルは削除する。入力動画や抽出条件が変わっている場合は何も再利用しない
+
+        Returns:
+            サムネイルを再利用したシーン番号の集合
+        """
+        if (
+            previous.get("video") != manifest["video"]
+            or previous.get("params") != manifest["params"]
+        ):
+            return set()
+
+        previous_files: Dict[Tuple[int, int], Path] = {}
+        for entry in previous.get("scenes", []):
+            path = output_path / entry["file"]
+            if path.exists():
+                previous_files[(entry["start_frame"], entry["end_frame"])] = path
+
+        scenes_by_range = {(s.start_frame, s.end_frame): s for s in self.scenes}
+
+        # 範囲が一致しなくなったファイルを削除
+        for frame_range, path in list(previous_files.items()):
+            if frame_range not in scenes_by_range:
+                path.unlink()
+                del previous_files[frame_range]
+
+        # 番号の入れ替わりで上書きしないよう、一度一時名に退避してから付け替える
+        staged = []
+        for frame_range, path in previous_files.items():
+            scene = scenes_by_range[frame_range]
+            tmp_path = output_path / f".reuse_{scene.scene_num:04d}.jpg"
+            os.replace(path, tmp_path)
+            staged.append((scene, tmp_path))
+
+        reused = set()
+        for scene, tmp_path in staged:
+            filepath = output_path / f"scene_{scene.scene_num:04d}.jpg"
+            os.replace(tmp_path, filepath)
+            scene.thumbnail_path = str(filepath)
+            reused.add(scene.scene_num)
+
+        return reused
+
+    def _prune_scene_caches(self, output_path: Path):
+        """
+        現在のシーンに存在しないフレーム範囲のキャッシュ（.parts/, previews/）を削除する
+
+        キャッシュのファイル名は "<開始フレーム>-<終了フレーム>" で始まる
+        """
+        ranges = {f"{s.start_frame}-{s.end_frame}" for s in self.scenes}
+        for dirname in (PARTS_DIRNAME, PREVIEWS_DIRNAME):
+            cache_dir = output_path / dirname
+            if not cache_dir.is_dir():
+                continue
+            for path in cache_dir.iterdir():
+                if path.stem.split("_", 1)[0] not in ranges:
+                    path.unlink(missing_ok=True)
+
+    def _read_best_frame(
+        self,
+        cap: cv2.VideoCapture,
+        scene: SceneInfo,
+        position: float,
+        candidates: int,
+        window: float
+    ) -> Tuple[Optional[bytes], int]:
+        """
+        シーン内の抽出位置付近から最もサムネイル向きのフレームを読み出す
+
+        1回のシークの後に探索範囲を連続して読み進め、範囲全体に均等に配置した
+        候補をリングバッファ（最大 candidates 件）に保持する。各候補はJPEGに
+        エンコードしたデータと採点用の縮小グレースケール画像だけを持つため、
+        フル解像度のフレームを溜め込まず、勝者のために読み直す必要もない。
+        縮小版をまとめて採点し、勝者のJPEGデータを返す
+
+        Returns:
+            (選ばれたフレームのJPEGデータ（読み出せなければNone）, デコードしたフレーム数)
+        """
+        frame_range = scene.end_frame - scene.start_frame
+        target_frame = scene.start_frame + int(frame_range * position)
+
+        # 抽出位置を中心とした探索範囲（シーン内に収める）
+        span = 1
+        if candidates > 1:
+            span = max(1, min(int(window * self.fps), frame_range))
+        window_start = max(target_frame - span // 2, scene.start_frame)
+        window_start = max(min(window_start, scene.end_frame - span), scene.start_frame)
+
+        # 候補の位置（探索範囲の先頭からのオフセット）を範囲全体に均等に配置
+        candidate_offsets = set(
+            np.linspace(0, span - 1, max(candidates, 1)).round().astype(int).tolist()
+        )
+        last_offset = max(candidate_offsets)
+
+        cap.set(cv2.CAP_PROP_POS_FRAMES, window_start)
+
+        # (JPEGデータ, 縮小グレースケール画像)
+        ring = deque(maxlen=len(candidate_offsets))
+        decoded = 0
+        for offset in range(last_offset + 1):
+            if offset not in candidate_offsets:
+                # 候補以外はデコードのみで画像への変換を省く
+                if not cap.grab():
+                    break
+                decoded += 1
+                continue
+
+            ret, frame = cap.read()
+            if not ret:
+                break
+            decoded += 1
+
+            ok, encoded = cv2.imencode(".jpg", frame)
+            if not ok:
+                continue
+
+            height, width = frame.shape[:2]
+            small = cv2.resize(
+                frame,
+                (CANDIDATE_WIDTH, max(1, height * CANDIDATE_WIDTH // width)),
+                interpolation=cv2.INTER_AREA
+            )
+            ring.append((encoded.tobytes(), cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)))
+
+        if not ring:
+            return None, decoded
+        if len(ring) == 1:
+            return ring[0][0], decoded
+
+        scores = score_candidates(np.stack([gray for _, gray in ring]))
+        return ring[int(np.argmax(scores))][0], decoded
+
     def get_video_info(self) -> dict:
         """動画の基本情報を取得"""
         return {